@@ -1,8 +1,21 @@
 # In a new file called app.py
 import os
 import re
-from flask import Flask, request, jsonify, render_template, redirect, url_for
-import requests
+import asyncio
+import contextlib
+import functools
+import hashlib
+import sqlite3
+import threading
+import time
+from cachetools import TTLCache
+from cachetools.keys import hashkey
+from jinja2 import FileSystemBytecodeCache
+from quart import Quart, request, jsonify, render_template, stream_template, make_response, redirect, url_for
+from quart.json.provider import DefaultJSONProvider
+from quart.utils import run_sync
+import httpx
+import orjson
 import google.generativeai as genai
 from dotenv import load_dotenv
 
@@ -12,7 +25,201 @@ load_dotenv()
 # Configure Google AI with API key from environment variable
 genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
 
-app = Flask(__name__)
+# Shared Gemini client; created once rather than per request
+MODEL = genai.GenerativeModel('gemini-2.5-flash')
+
+# ASGI app; serve in production with:
+#   gunicorn -k uvicorn.workers.UvicornWorker -w 4 app:app
+app = Quart(__name__)
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson for jsonify() and request.get_json()."""
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+app.json = OrjsonProvider(app)
+
+# Keep compiled templates across worker restarts and skip per-render mtime checks.
+# Without JINJA_CACHE_DIR, Jinja picks a private per-user directory (0700,
+# owner-checked) so other local users cannot plant bytecode for us to load.
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR")
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+if not app.debug:
+    app.jinja_env.auto_reload = False
+
+class RetryTransport(httpx.AsyncHTTPTransport):
+    """Async transport that retries transient gateway errors with exponential backoff."""
+
+    def __init__(self, total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504), **kwargs):
+        # Connection-level failures are retried by httpx itself
+        super().__init__(retries=total, **kwargs)
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = frozenset(status_forcelist)
+
+    async def handle_async_request(self, req):
+        attempt = 0
+        while True:
+            resp = await super().handle_async_request(req)
+            if resp.status_code not in self.status_forcelist or attempt >= self.total:
+                return resp
+            await resp.aclose()
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+            attempt += 1
+
+# Shared async HTTP clients for all upstream calls, one connection pool per worker.
+# Keep-alive pool sized for a handful of concurrent briefings to aviationweather.gov
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+HTTP = httpx.AsyncClient(
+    timeout=10,
+    headers={"Accept-Encoding": "gzip"},
+    transport=RetryTransport(http2=True, limits=HTTP_LIMITS),
+)
+# Separate client for the OSM Nominatim fallback, which requires its own User-Agent.
+# No RetryTransport: quick retries would exceed Nominatim's 1 req/s usage policy.
+NOMINATIM = httpx.AsyncClient(
+    timeout=8,
+    headers={"User-Agent": "ApacheAI-Weather-Briefer/1.0 (contact: local)"},
+    transport=httpx.AsyncHTTPTransport(limits=httpx.Limits(max_connections=2, max_keepalive_connections=2)),
+)
+
+@app.after_serving
+async def close_http_clients():
+    await HTTP.aclose()
+    await NOMINATIM.aclose()
+
+def _codes_key(icao_codes):
+    """Cache key for a set of ICAO codes, independent of order and case."""
+    return tuple(sorted(set(normalize_icao_list(" ".join(icao_codes or [])))))
+
+def _fetched(value):
+    """Fetchers return None for a failed upstream call; '' or {} is a valid empty answer."""
+    return value is not None
+
+def ttl_cached(ttl, maxsize=512, key=_codes_key, ok=_fetched):
+    """Cache the results of an async fetcher for ``ttl`` seconds.
+
+    Results for which ``ok(result)`` is false (by default None, a failed
+    upstream call) are never stored, so a transient outage is retried on the
+    next request. Concurrent misses for the same key share one upstream call
+    (e.g. /api/coords arriving while the briefing that warms the stations cache
+    is still in flight).
+    """
+    def decorator(func):
+        cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        # Never held across an await, so it is safe on the event loop and from threads
+        lock = threading.RLock()
+        in_flight = {}
+
+        async def load(k, args, kwargs):
+            try:
+                value = await func(*args, **kwargs)
+                if ok(value):
+                    with lock:
+                        cache[k] = value
+                return value
+            finally:
+                in_flight.pop(k, None)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            k = key(*args, **kwargs)
+            with lock:
+                hit = cache.get(k)
+            if hit is not None:
+                return hit
+            task = in_flight.get(k)
+            if task is None:
+                task = in_flight[k] = asyncio.ensure_future(load(k, args, kwargs))
+            # Shielded so one cancelled caller doesn't cancel the shared fetch
+            return await asyncio.shield(task)
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+async def fetch_briefing_inputs(codes, hours_before=6):
+    """Fetch METARs, TAFs, hazards and station metadata concurrently."""
+    return await asyncio.gather(
+        fetch_metars_async(codes),
+        fetch_tafs_async(codes),
+        fetch_sigmet_airmet_async(hours_before=hours_before),
+        fetch_stations_async(codes),
+    )
+
+async def gather_briefing(codes):
+    """Fetch the raw weather text and station metadata for the ICAO codes.
+
+    Returns (weather_text, stations) where stations is the fetch_stations_async
+    dict; weather_text is empty when no weather data could be fetched at all.
+    """
+    metars_text, tafs_text, hazards_text, stations = await fetch_briefing_inputs(codes, hours_before=6)
+    stations = stations or {}
+    combined_text = ''
+    if metars_text:
+        combined_text += 'METARs:\n' + metars_text + '\n\n'
+    if tafs_text:
+        combined_text += 'TAFs:\n' + tafs_text + '\n\n'
+    if hazards_text:
+        combined_text += 'Hazards(if any):\n' + hazards_text + '\n\n'
+    return combined_text.strip(), stations
+
+async def build_briefing(codes, pilot_profile):
+    """Fetch weather for the ICAO codes and summarize it for the pilot profile.
+
+    Returns (summary_html, stations) where stations is the list of
+    {icao, name, lat, lon} records; summary_html is None when no weather data
+    could be fetched at all.
+    """
+    weather_text, stations = await gather_briefing(codes)
+    if not weather_text:
+        return None, station_records(codes, stations)
+    summary_html = await summarize_weather(weather_text, pilot_profile=pilot_profile,
+                                     stations=station_names(codes, stations))
+    return summary_html, station_records(codes, stations)
+
+async def stream_briefing(codes, pilot_profile):
+    """Like build_briefing, but stream the summary.
+
+    Returns (chunks, key): an async generator of summary HTML chunks and the
+    prompt cache key identifying the exact weather/stations/profile input, or
+    (None, None) when no weather data could be fetched at all.
+    """
+    weather_text, stations = await gather_briefing(codes)
+    if not weather_text:
+        return None, None
+    names = station_names(codes, stations)
+    _, key = _briefing_request(weather_text, pilot_profile, names)
+    return summarize_weather_stream(weather_text, pilot_profile=pilot_profile, stations=names), key
+
+async def render_briefing(codes, pilot_profile, error_template):
+    """Stream summary.html for the codes, or 304 if the client already has this briefing."""
+    summary_chunks, key = await stream_briefing(codes, pilot_profile)
+    if summary_chunks is None:
+        return await render_template(error_template, error="Failed to fetch METAR/TAF/AIRMET/SIGMET data."), 502
+    # Only a briefing already generated successfully gets an ETag, so an error
+    # page is never revalidated in place of a retry. The tag follows the prompt,
+    # so it changes whenever the upstream data does; it is weak because
+    # regenerated model output may word the same briefing differently.
+    cached = _cached_summary(key) is not None
+    if cached and request.if_none_match.contains_weak(key):
+        response = await make_response("", 304)
+    else:
+        response = await make_response(await stream_template("summary.html", summary_chunks=summary_chunks, icao_codes=codes))
+    if cached:
+        response.set_etag(key, weak=True)
+        # Revalidate every time: the tag is only current while the weather input is
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
 
 try:
     # Try to import the PIREP converter
@@ -21,49 +228,41 @@ except Exception:
     convert_english_to_pirep = None
 
 @app.get("/")
-def index():
+async def index():
     # Render a single-input homepage
-    return render_template("index.html")
+    return await render_template("index.html")
 
 @app.get("/icao")
-def icao_get():
-    return render_template("icao_input.html")
+async def icao_get():
+    return await render_template("icao_input.html")
 
 @app.post("/icao")
-def icao_post():
-    text = request.form.get("text", "").strip()
-    pilot_profile = request.form.get("pilot_profile", "VFR").strip() or "VFR"
+async def icao_post():
+    form = await request.form
+    text = form.get("text", "").strip()
+    pilot_profile = form.get("pilot_profile", "VFR").strip() or "VFR"
     if not text:
-        return render_template("icao_input.html", error="Please enter 4-letter ICAO codes."), 400
-    if not is_icao_list(text):
-        return render_template("icao_input.html", error="Please enter valid 4-letter ICAO codes (e.g., VABB VOMM)."), 400
-    codes = normalize_icao_list(text)
-    metars_text = fetch_metars(codes)
-    tafs_text = fetch_tafs(codes)
-    hazards_text = fetch_sigmet_airmet(hours_before=6)
-    combined_text = ''
-    if metars_text:
-        combined_text += 'METARs:\n' + metars_text + '\n\n'
-    if tafs_text:
-        combined_text += 'TAFs:\n' + tafs_text + '\n\n'
-    if hazards_text:
-        combined_text += 'Hazards(if any):\n' + hazards_text + '\n\n'
-    stations = fetch_station_info(codes)
-    summary_html = summarize_weather(combined_text.strip(), pilot_profile=pilot_profile, stations=stations)
-    return render_template("summary.html", summary_html=summary_html, icao_codes=codes)
+        return await render_template("icao_input.html", error="Please enter 4-letter ICAO codes."), 400
+    codes = parse_icao_list(text)
+    if codes is None:
+        return await render_template("icao_input.html", error="Please enter valid 4-letter ICAO codes (e.g., VABB VOMM)."), 400
+    return await render_briefing(codes, pilot_profile, "icao_input.html")
 
 @app.get("/pirep")
-def pirep_get():
-    return render_template("pirep_input.html")
+async def pirep_get():
+    return await render_template("pirep_input.html")
 
 @app.post("/pirep")
-def pirep_post():
+async def pirep_post():
     # Gather structured fields
-    problem_type = (request.form.get("problem_type", "") or "").strip()
-    location = (request.form.get("location", "") or "").strip()
-    aircraft_model = (request.form.get("aircraft_model", "") or "").strip()
-    altitude = (request.form.get("altitude", "") or "").strip()
-    text = (request.form.get("text", "") or "").strip()
+    form = await request.form
+    problem_type = (form.get("problem_type", "") or "").strip()
+    location = (form.get("location", "") or "").strip()
+    aircraft_model = (form.get("aircraft_model", "") or "").strip()
+    altitude = (form.get("altitude", "") or "").strip()
+    text = (form.get("text", "") or "").strip()
+    # Free text may carry details the fields lack, so only skip the model without it
+    has_free_text = bool(text)
 
     # If no free text provided, synthesize a plain-English line from fields
     if not text:
@@ -83,78 +282,66 @@ def pirep_post():
         text = ", ".join(parts).strip(", ")
 
     if not text:
-        return render_template("pirep_input.html", error="Please fill at least one field or the description."), 400
+        return await render_template("pirep_input.html", error="Please fill at least one field or the description."), 400
     if convert_english_to_pirep is None:
-        return render_template("pirep.html", pirep_text=None, error="PIREP conversion module not available."), 500
+        return await render_template("pirep.html", pirep_text=None, error="PIREP conversion module not available."), 500
     try:
-        pirep_line = convert_english_to_pirep(text, fields={
+        # The Gemini call is blocking, so run it off the event loop
+        pirep_line = await run_sync(convert_english_to_pirep)(text, fields={
             'problem_type': problem_type,
             'location': location,
             'aircraft_model': aircraft_model,
             'altitude': altitude,
-        })
+        }, allow_fast_path=not has_free_text)
     except Exception as e:
-        return render_template("pirep_input.html", error=f"Error converting to PIREP: {e}"), 500
-    return render_template("pirep.html", pirep_text=pirep_line, error=None)
+        return await render_template("pirep_input.html", error=f"Error converting to PIREP: {e}"), 500
+    return await render_template("pirep.html", pirep_text=pirep_line, error=None)
+
+def parse_icao_list(text: str):
+    """Return the normalized codes if text is a list of 4-letter ICAO codes, else None."""
+    parts = normalize_icao_list(text)
+    # Each part must be exactly 4 alphabetic (ASCII) letters
+    if parts and all(len(p) == 4 and p.isalpha() and p.isascii() for p in parts):
+        return parts
+    return None
 
 def is_icao_list(text: str) -> bool:
     """Return True if the text appears to be a list of 4-letter ICAO codes."""
-    if not text:
-        return False
-    cand = text.strip().upper()
-    # Accept separators: commas and/or whitespace
-    parts = re.split(r"[\s,]+", cand)
-    parts = [p for p in parts if p]
-    if not parts:
-        return False
-    # Each part must be exactly 4 alphabetic letters
-    return all(re.fullmatch(r"[A-Z]{4}", p) for p in parts)
+    return parse_icao_list(text) is not None
 
 def normalize_icao_list(text: str):
-    parts = re.split(r"[\s,]+", (text or "").strip().upper())
-    return [p for p in parts if p]
+    # Accept separators: commas and/or whitespace (str.split() drops empty parts)
+    return (text or "").upper().replace(",", " ").split()
 
 @app.post("/process")
-def process_input():
+async def process_input():
     """Decide whether the input is ICAO codes or free-text PIREP and route accordingly."""
-    text = request.form.get("text", "").strip()
-    pilot_profile = request.form.get("pilot_profile", "VFR").strip() or "VFR"
+    form = await request.form
+    text = form.get("text", "").strip()
+    pilot_profile = form.get("pilot_profile", "VFR").strip() or "VFR"
     if not text:
         # Back to index with an error message
-        return render_template("index.html", error="Please enter ICAO codes or a PIREP in plain English."), 400
+        return await render_template("index.html", error="Please enter ICAO codes or a PIREP in plain English."), 400
 
-    if is_icao_list(text):
+    codes = parse_icao_list(text)
+    if codes is not None:
         # ICAO flow -> build summary and render summary page
-        codes = normalize_icao_list(text)
-        metars_text = fetch_metars(codes)
-        tafs_text = fetch_tafs(codes)
-        hazards_text = fetch_sigmet_airmet(hours_before=6)
-
-        combined_text = ''
-        if metars_text:
-            combined_text += 'METARs:\n' + metars_text + '\n\n'
-        if tafs_text:
-            combined_text += 'TAFs:\n' + tafs_text + '\n\n'
-        if hazards_text:
-            combined_text += 'Hazards(if any):\n' + hazards_text + '\n\n'
-
-        stations = fetch_station_info(codes)
-        summary_html = summarize_weather(combined_text.strip(), pilot_profile=pilot_profile, stations=stations)
-        return render_template("summary.html", summary_html=summary_html, icao_codes=codes)
+        return await render_briefing(codes, pilot_profile, "index.html")
 
     # Otherwise treat as free-text PIREP
     if convert_english_to_pirep is None:
-        return render_template("pirep.html", pirep_text=None, error="PIREP conversion module not available."), 500
+        return await render_template("pirep.html", pirep_text=None, error="PIREP conversion module not available."), 500
 
     try:
-        pirep_line = convert_english_to_pirep(text)
+        pirep_line = await run_sync(convert_english_to_pirep)(text)
     except Exception as e:
-        return render_template("pirep.html", pirep_text=None, error=f"Error converting to PIREP: {e}"), 500
+        return await render_template("pirep.html", pirep_text=None, error=f"Error converting to PIREP: {e}"), 500
 
-    return render_template("pirep.html", pirep_text=pirep_line, error=None)
+    return await render_template("pirep.html", pirep_text=pirep_line, error=None)
 
-def fetch_metars(icao_codes):
-    """Fetch raw METAR data for the given ICAO codes using AviationWeather API."""
+@ttl_cached(ttl=600)
+async def fetch_metars_async(icao_codes):
+    """Fetch raw METAR data for the given ICAO codes using AviationWeather API; None on failure."""
     if not icao_codes:
         return ""
     # Normalize and join codes
@@ -164,20 +351,29 @@ def fetch_metars(icao_codes):
     ids_param = ",".join(codes)
     url = f"https://aviationweather.gov/api/data/metar?format=raw&hours=2&ids={ids_param}"
     try:
-        resp = requests.get(url, timeout=10)
+        resp = await HTTP.get(url)
         if resp.status_code != 200:
-            return ""
+            return None
         text = resp.text.strip()
         return text
     except Exception:
-        return ""
+        return None
+
+# Alternative property names used by the stations endpoint for the same field
+_ID_KEYS = ('station_id', 'icao_site', 'icao_code')
+_NAME_KEYS = ('site', 'station_name', 'name')
+_LAT_KEYS = ('latitude', 'lat', 'latitude_deg', 'latitude_degN')
+_LON_KEYS = ('longitude', 'lon', 'longitude_deg', 'longitude_degE')
 
-def fetch_station_info(icao_codes):
-    """Fetch station (airport) names for given ICAO codes. Returns dict {ICAO: Name}."""
+def _first(props, keys, default=None):
+    return next((props[k] for k in keys if props.get(k)), default)
+
+@ttl_cached(ttl=86400)
+async def fetch_stations_async(icao_codes):
+    """Fetch station metadata for given ICAO codes. Returns dict {ICAO: {name, lat, lon}}, or None on failure."""
     if not icao_codes:
         return {}
-    # Normalize list
-    codes = [c.strip().upper() for c in icao_codes if c.strip()]
+    codes = [c.strip().upper() for c in icao_codes if c and c.strip()]
     if not codes:
         return {}
     base = "https://aviationweather.gov/dataserver_current/httpparam"
@@ -188,10 +384,9 @@ def fetch_station_info(icao_codes):
         "stationstring": ",".join(codes)
     }
     try:
-        r = requests.get(base, params=params, headers={"Accept": "application/json"}, timeout=10)
-        if r.status_code != 200:
-            return {c: "" for c in codes}
-        j = r.json()
+        r = await HTTP.get(base, params=params, headers={"Accept": "application/json"})
+        r.raise_for_status()
+        j = orjson.loads(r.content)
         # Response can be under 'features' (GeoJSON) or 'data' list
         data = j.get('features') or j.get('stations', {}).get('data') or []
         out = {}
@@ -200,51 +395,12 @@ def fetch_station_info(icao_codes):
                 props = item.get('properties') if isinstance(item, dict) else item
                 if not isinstance(props, dict):
                     continue
-                icao = (props.get('station_id') or props.get('icao_site') or props.get('icao_code') or "").upper()
-                name = props.get('site') or props.get('station_name') or props.get('name') or ""
-                if icao:
-                    out[icao] = name
-        # Ensure all requested codes are present
-        for c in codes:
-            out.setdefault(c, "")
-        return out
-    except Exception:
-        return {c: "" for c in codes}
-
-def fetch_station_coords(icao_codes):
-    """Fetch lat/lon for given ICAO codes. Returns list of dicts: {icao, name, lat, lon}."""
-    if not icao_codes:
-        return []
-    codes = [c.strip().upper() for c in icao_codes if c and c.strip()]
-    if not codes:
-        return []
-    base = "https://aviationweather.gov/dataserver_current/httpparam"
-    params = {
-        "datasource": "stations",
-        "requesttype": "retrieve",
-        "format": "json",
-        "stationstring": ",".join(codes)
-    }
-    try:
-        r = requests.get(base, params=params, headers={"Accept": "application/json"}, timeout=10)
-        r.raise_for_status()
-        j = r.json()
-        data = j.get('features') or j.get('stations', {}).get('data') or []
-        out = []
-        seen = set()
-        if isinstance(data, list):
-            for item in data:
-                props = item.get('properties') if isinstance(item, dict) else item
-                if not isinstance(props, dict):
-                    continue
-                icao = (props.get('station_id') or props.get('icao_site') or props.get('icao_code') or "").upper()
-                if not icao or icao in seen:
+                icao = _first(props, _ID_KEYS, "").upper()
+                if not icao or icao in out:
                     continue
-                seen.add(icao)
-                name = props.get('site') or props.get('station_name') or props.get('name') or ""
                 # Robust lat/lon extraction from properties first
-                lat = props.get('latitude') or props.get('lat') or props.get('latitude_deg') or props.get('latitude_degN')
-                lon = props.get('longitude') or props.get('lon') or props.get('longitude_deg') or props.get('longitude_degE')
+                lat = _first(props, _LAT_KEYS)
+                lon = _first(props, _LON_KEYS)
                 # If still missing, try GeoJSON geometry.coordinates [lon, lat]
                 if (lat is None or lon is None) and isinstance(item, dict):
                     geom = item.get('geometry') or {}
@@ -257,93 +413,179 @@ def fetch_station_coords(icao_codes):
                     lon = float(lon) if lon is not None else None
                 except Exception:
                     lat, lon = None, None
-                out.append({"icao": icao, "name": name, "lat": lat, "lon": lon})
-        # Fill missing coords via a conservative OSM Nominatim fallback
-        try:
-            session = requests.Session()
-            session.headers.update({
-                "User-Agent": "ApacheAI-Weather-Briefer/1.0 (contact: local)"
-            })
-            for rec in out:
-                if rec.get('lat') is None or rec.get('lon') is None:
-                    q = f"airport {rec.get('icao','')}"
-                    try:
-                        nom = session.get(
-                            "https://nominatim.openstreetmap.org/search",
-                            params={"format": "json", "q": q, "limit": 1},
-                            timeout=8
-                        )
-                        if nom.status_code == 200:
-                            arr = nom.json()
-                            if isinstance(arr, list) and arr:
-                                rec['lat'] = float(arr[0]['lat'])
-                                rec['lon'] = float(arr[0]['lon'])
-                    except Exception:
-                        pass
-        except Exception:
-            pass
-
-        # Ensure requested order
-        order = {c: i for i, c in enumerate(codes)}
-        out.sort(key=lambda x: order.get(x.get('icao', ''), 1e9))
+                out[icao] = {"name": _first(props, _NAME_KEYS, ""), "lat": lat, "lon": lon}
         return out
     except Exception:
-        # Return placeholders with no coords
-        return [{"icao": c, "name": "", "lat": None, "lon": None} for c in codes]
+        return None
+
+def station_names(icao_codes, stations):
+    """Project fetch_stations_async output to {ICAO: Name} for every requested code."""
+    return {c: stations.get(c, {}).get("name", "") for c in icao_codes}
+
+def station_records(icao_codes, stations):
+    """Project fetch_stations_async output to [{icao, name, lat, lon}] in requested order."""
+    return [{"icao": c, **stations[c]} for c in icao_codes if c in stations]
+
+# Airports don't move: coordinates resolved via Nominatim are kept on disk
+AIRPORT_COORDS_DB = os.getenv(
+    "AIRPORT_COORDS_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "airport_coords.db"),
+)
+# Nominatim's usage policy allows at most one request per second
+NOMINATIM_MIN_INTERVAL = 1.0
+_NOMINATIM_SEMAPHORE = asyncio.Semaphore(1)
+_nominatim_last_request = 0.0
+
+def _coords_db():
+    return sqlite3.connect(AIRPORT_COORDS_DB)
+
+def init_airport_coords_db():
+    """Create the airport_coords table if it does not exist yet."""
+    with contextlib.closing(_coords_db()) as conn, conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS airport_coords (icao TEXT PRIMARY KEY, lat REAL NOT NULL, lon REAL NOT NULL)")
+
+@app.before_serving
+async def create_airport_coords_table():
+    # Once per worker at startup rather than on every connection
+    try:
+        await run_sync(init_airport_coords_db)()
+    except sqlite3.Error:
+        pass
 
-def fetch_sigmet_airmet(hours_before=6):
-    """Fetch active SIGMETs and AIRMETs from AviationWeather ADDS Data Server (JSON)."""
+def load_airport_coords(icao_codes):
+    """Return {ICAO: (lat, lon)} for codes already resolved on disk."""
+    if not icao_codes:
+        return {}
+    try:
+        with contextlib.closing(_coords_db()) as conn:
+            placeholders = ",".join("?" * len(icao_codes))
+            rows = conn.execute(
+                f"SELECT icao, lat, lon FROM airport_coords WHERE icao IN ({placeholders})",
+                list(icao_codes),
+            ).fetchall()
+        return {icao: (lat, lon) for icao, lat, lon in rows}
+    except sqlite3.Error:
+        return {}
+
+def save_airport_coords(coords):
+    """Persist {ICAO: (lat, lon)} mappings."""
+    if not coords:
+        return
+    try:
+        # closing() releases the connection; the inner "with conn" commits
+        with contextlib.closing(_coords_db()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO airport_coords (icao, lat, lon) VALUES (?, ?, ?)",
+                [(icao, lat, lon) for icao, (lat, lon) in coords.items()],
+            )
+    except sqlite3.Error:
+        pass
+
+async def nominatim_lookup_async(icao):
+    """Look up an airport's (lat, lon) on OSM Nominatim, or None. Rate limited to 1 req/s."""
+    global _nominatim_last_request
+    async with _NOMINATIM_SEMAPHORE:
+        wait = _nominatim_last_request + NOMINATIM_MIN_INTERVAL - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        _nominatim_last_request = time.monotonic()
+        try:
+            nom = await NOMINATIM.get(
+                "https://nominatim.openstreetmap.org/search",
+                params={"format": "json", "q": f"airport {icao}", "limit": 1}
+            )
+            if nom.status_code == 200:
+                arr = orjson.loads(nom.content)
+                if isinstance(arr, list) and arr:
+                    return float(arr[0]['lat']), float(arr[0]['lon'])
+        except Exception:
+            pass
+    return None
+
+async def fill_missing_coords_async(stations):
+    """Fill missing lat/lon in station records in place, from disk first, then Nominatim."""
+    missing = [rec for rec in stations if rec.get('lat') is None or rec.get('lon') is None]
+    if not missing:
+        return stations
+    # SQLite calls block, so run them off the event loop
+    known = await run_sync(load_airport_coords)([rec['icao'] for rec in missing])
+    unresolved = []
+    for rec in missing:
+        if rec['icao'] in known:
+            rec['lat'], rec['lon'] = known[rec['icao']]
+        else:
+            unresolved.append(rec)
+    if unresolved:
+        results = await asyncio.gather(*[nominatim_lookup_async(rec['icao']) for rec in unresolved])
+        found = {}
+        for rec, latlon in zip(unresolved, results):
+            if latlon is not None:
+                rec['lat'], rec['lon'] = latlon
+                found[rec['icao']] = latlon
+        await run_sync(save_airport_coords)(found)
+    return stations
+
+@ttl_cached(ttl=300, key=lambda hours_before=6: hashkey(hours_before))
+async def fetch_sigmet_airmet_async(hours_before=6):
+    """Fetch active SIGMETs and AIRMETs from AviationWeather ADDS Data Server (JSON).
+
+    Returns '' when none are active, or None if either request failed.
+    """
     base = "https://aviationweather.gov/dataserver_current/httpparam"
     headers = {"Accept": "application/json"}
     pieces = []
+    # SIGMETs
+    sig_params = {
+        "datasource": "sigmet",
+        "requesttype": "retrieve",
+        "format": "json",
+        "hoursBeforeNow": str(hours_before)
+    }
+    # AIRMETs (including G-AIRMET)
+    air_params = {
+        "datasource": "airsigmets",
+        "requesttype": "retrieve",
+        "format": "json",
+        "hoursBeforeNow": str(hours_before)
+    }
     try:
-        # SIGMETs
-        sig_params = {
-            "datasource": "sigmet",
-            "requesttype": "retrieve",
-            "format": "json",
-            "hoursBeforeNow": str(hours_before)
-        }
-        r1 = requests.get(base, params=sig_params, headers=headers, timeout=10)
-        if r1.status_code == 200:
-            j = r1.json()
-            data = j.get('features') or j.get('sigmet', {}).get('data') or []
-            # Some responses use GeoJSON under 'features', others nested under 'data'
-            if isinstance(data, list) and data:
-                texts = []
-                for item in data:
-                    props = item.get('properties') if isinstance(item, dict) else item
-                    txt = (props or {}).get('raw_text') or (props or {}).get('description')
-                    if txt:
-                        texts.append(txt)
-                if texts:
-                    pieces.append("SIGMETs:\n" + "\n".join(texts))
-        # AIRMETs (including G-AIRMET)
-        air_params = {
-            "datasource": "airsigmets",
-            "requesttype": "retrieve",
-            "format": "json",
-            "hoursBeforeNow": str(hours_before)
-        }
-        r2 = requests.get(base, params=air_params, headers=headers, timeout=10)
-        if r2.status_code == 200:
-            j = r2.json()
-            data = j.get('features') or j.get('airsigmet', {}).get('data') or []
-            if isinstance(data, list) and data:
-                texts = []
-                for item in data:
-                    props = item.get('properties') if isinstance(item, dict) else item
-                    txt = (props or {}).get('raw_text') or (props or {}).get('hazard') or (props or {}).get('message')
-                    if txt:
-                        texts.append(txt)
-                if texts:
-                    pieces.append("AIRMETs:\n" + "\n".join(texts))
+        r1, r2 = await asyncio.gather(
+            HTTP.get(base, params=sig_params, headers=headers),
+            HTTP.get(base, params=air_params, headers=headers),
+        )
+        # A partial list could read as "no SIGMETs" when they are only unknown
+        if r1.status_code != 200 or r2.status_code != 200:
+            return None
+        j = orjson.loads(r1.content)
+        data = j.get('features') or j.get('sigmet', {}).get('data') or []
+        # Some responses use GeoJSON under 'features', others nested under 'data'
+        if isinstance(data, list) and data:
+            texts = []
+            for item in data:
+                props = item.get('properties') if isinstance(item, dict) else item
+                txt = (props or {}).get('raw_text') or (props or {}).get('description')
+                if txt:
+                    texts.append(txt)
+            if texts:
+                pieces.append("SIGMETs:\n" + "\n".join(texts))
+        j = orjson.loads(r2.content)
+        data = j.get('features') or j.get('airsigmet', {}).get('data') or []
+        if isinstance(data, list) and data:
+            texts = []
+            for item in data:
+                props = item.get('properties') if isinstance(item, dict) else item
+                txt = (props or {}).get('raw_text') or (props or {}).get('hazard') or (props or {}).get('message')
+                if txt:
+                    texts.append(txt)
+            if texts:
+                pieces.append("AIRMETs:\n" + "\n".join(texts))
     except Exception:
-        return ""
+        return None
     return "\n\n".join(pieces).strip()
 
-def fetch_tafs(icao_codes):
-    """Fetch raw TAF data for the given ICAO codes using AviationWeather API."""
+@ttl_cached(ttl=3600)
+async def fetch_tafs_async(icao_codes):
+    """Fetch raw TAF data for the given ICAO codes using AviationWeather API; None on failure."""
     if not icao_codes:
         return ""
     codes = [c.strip().upper() for c in icao_codes if c.strip()]
@@ -352,114 +594,171 @@ def fetch_tafs(icao_codes):
     ids_param = ",".join(codes)
     url = f"https://aviationweather.gov/api/data/taf?format=raw&hours=24&ids={ids_param}"
     try:
-        resp = requests.get(url, timeout=10)
+        resp = await HTTP.get(url)
         if resp.status_code != 200:
-            return ""
+            return None
         return resp.text.strip()
     except Exception:
-        return ""
-
-def summarize_weather(weather_data, pilot_profile, stations):
+        return None
+
+# Fixed role, output schema and rules for the briefer; sent ahead of the
+# per-request data so repeated calls share a cacheable prompt prefix.
+STATIC_BRIEFER_PROMPT = """
+You are an expert aviation weather briefer, writing for the AUDIENCE PILOT PROFILE given below.
+Read the RAW WEATHER DATA and the AIRPORT DIRECTORY below and produce three sections only, as concise HTML:
+1) <section id="summary"><h2>Summary</h2><ul><li>...</li></ul></section>
+2) <section id="recommendations"><h2>Recommendations</h2><ul><li>...</li></ul></section>
+3) <section id="per-airport"><h2>Per-Airport Conditions</h2>
+     <ul>
+       <li><strong>VABB - Chhatrapati Shivaji Intl</strong>: decoded current conditions, ceilings/visibility, winds, precip, hazards; brief TAF outlook.</li>
+       <li><strong>VOMM - Chennai Intl</strong>: ...</li>
+     </ul>
+   </section>
+
+- Keep bullets brief and safety-forward.
+- No preamble or explanations outside these sections.
+- Do not include the raw data itself in your output. Decode it to plain language.
+- When showing Per-Airport Conditions, make it so that every individual feature is shown in a new line, along with a bullet point.
+- Make the summaries be 1-2 sentences only. Include any values that are of value to the pilot.
+- Also, In the recommendations section, I want you to summarise the journey into various legs. If there are two airports, I want to see the weather report for the journey between them
+- In case there are multiple airports, then i want to see the weather report from airport 1 to 2, then 2 to 3, then 3 to 4 and so on.
+"""
+
+async def _generate_briefing(dynamic, stream=False):
+    """Ask Gemini for a briefing, sending the static prefix ahead of the dynamic part.
+
+    STATIC_BRIEFER_PROMPT (~350 tokens) is below the minimum size for an explicit
+    CachedContent, so it is sent inline and relies on Gemini's implicit caching.
+    """
+    return await MODEL.generate_content_async([STATIC_BRIEFER_PROMPT, dynamic], stream=stream)
+
+# Model output keyed by SHA-256 of the prompt
+SUMMARY_CACHE = TTLCache(maxsize=1024, ttl=900)
+_SUMMARY_CACHE_LOCK = threading.RLock()
+
+_SECTION_IDS = ('id="summary"', 'id="recommendations"', 'id="per-airport"')
+# Start of every <h1>/<h2>, capturing the leading heading text past any inline
+# tags (e.g. <h2><strong>Summary</strong></h2>)
+_HEADING_RE = re.compile(r'<h[12]\b[^>]*>\s*(?:<[^>]+>\s*)*([^<]*)', re.I)
+
+def normalize_sections(html: str) -> str:
+    """Wrap the model's Summary/Recommendations blocks in <section id=...>; the rest becomes per-airport."""
+    # Fast-path: if all three IDs exist, keep as-is
+    if all(x in html for x in _SECTION_IDS):
+        return html
+
+    # One pass over the headings; each block runs until the next <h1>/<h2> or the end
+    starts = [(m.start(), m.group(1).strip().lower()) for m in _HEADING_RE.finditer(html)]
+    blocks = {}
+    for i, (start, title) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else len(html)
+        for sec_id in ('summary', 'recommendations'):
+            if sec_id not in blocks and title.startswith(sec_id):
+                blocks[sec_id] = (start, end)
+
+    out_parts = []
+    for sec_id in ('summary', 'recommendations'):
+        if sec_id in blocks:
+            start, end = blocks[sec_id]
+            out_parts.append(f'<section id="{sec_id}">{html[start:end]}</section>')
+    # Whatever remains becomes per-airport
+    remainder, pos = [], 0
+    for start, end in sorted(blocks.values()):
+        remainder.append(html[pos:start])
+        pos = end
+    remainder.append(html[pos:])
+    remainder = ''.join(remainder).strip()
+    if remainder:
+        out_parts.append(f'<section id="per-airport">{remainder}</section>')
+    return '\n'.join(out_parts)
+
+def _briefing_request(weather_data, pilot_profile, stations):
+    """Return (dynamic prompt part, cache key) for a briefing request."""
+    # Build a simple ICAO -> Name directory for the prompt
+    airport_directory = "\n".join([f"{k}: {v}" if v else f"{k}:" for k, v in stations.items()])
+
+    # Invariant instructions go first so Gemini's implicit prefix cache can hit;
+    # only this small per-request tail changes between calls.
+    dynamic = f"""
+AUDIENCE PILOT PROFILE: '{pilot_profile}'
+
+AIRPORT DIRECTORY (ICAO -> Name):
+{airport_directory}
+
+RAW WEATHER DATA START
+{weather_data}
+RAW WEATHER DATA END
+"""
+
+    # The static prefix is constant, so the dynamic part alone identifies the prompt
+    return dynamic, hashlib.sha256(dynamic.encode()).hexdigest()
+
+def _response_text(response):
+    """Text of a Gemini response or stream chunk; '' when it carries no parts.
+
+    Unlike ``response.text``, a finish-only chunk (STOP, MAX_TOKENS, SAFETY...)
+    yields '' instead of raising. A response with no candidates at all (e.g. a
+    blocked prompt) still raises ValueError from ``response.parts``.
+    """
+    return ''.join(part.text for part in response.parts if part.text)
+
+def _cached_summary(key):
+    with _SUMMARY_CACHE_LOCK:
+        return SUMMARY_CACHE.get(key)
+
+def _store_summary(key, raw_html):
+    if raw_html:
+        with _SUMMARY_CACHE_LOCK:
+            SUMMARY_CACHE[key] = raw_html
+
+async def summarize_weather(weather_data, pilot_profile, stations):
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
-
-        # Build a simple ICAO -> Name directory for the prompt
-        airport_directory = "\n".join([f"{k}: {v}" if v else f"{k}:" for k, v in stations.items()])
-
-        prompt = f"""
-        You are an expert aviation weather briefer. Audience pilot profile: '{pilot_profile}'.
-        Read the RAW WEATHER DATA and the AIRPORT DIRECTORY and produce three sections only, as concise HTML:
-        1) <section id="summary"><h2>Summary</h2><ul><li>...</li></ul></section>
-        2) <section id="recommendations"><h2>Recommendations</h2><ul><li>...</li></ul></section>
-        3) <section id="per-airport"><h2>Per-Airport Conditions</h2>
-             <ul>
-               <li><strong>VABB - Chhatrapati Shivaji Intl</strong>: decoded current conditions, ceilings/visibility, winds, precip, hazards; brief TAF outlook.</li>
-               <li><strong>VOMM - Chennai Intl</strong>: ...</li>
-             </ul>
-           </section>
-
-        - Keep bullets brief and safety-forward.
-        - No preamble or explanations outside these sections.
-        - Do not include the raw data itself in your output. Decode it to plain language.
-        - When showing Per-Airport Conditions, make it so that every individual feature is shown in a new line, along with a bullet point.
-        - Make the summaries be 1-2 sentences only. Include any values that are of value to the pilot. 
-        - Also, In the recommendations section, I want you to summarise the journey into various legs. If there are two airports, I want to see the weather report for the journey between them
-        - In case there are multiple airports, then i want to see the weather report from airport 1 to 2, then 2 to 3, then 3 to 4 and so on.
-
-        AIRPORT DIRECTORY (ICAO -> Name):
-        {airport_directory}
-
-        RAW WEATHER DATA START
-        {weather_data}
-        RAW WEATHER DATA END
-        """
-
-        response = model.generate_content(prompt)
-        raw_html = (response.text or '').strip()
+        dynamic, key = _briefing_request(weather_data, pilot_profile, stations)
+        raw_html = _cached_summary(key)
+        if raw_html is None:
+            response = await _generate_briefing(dynamic)
+            raw_html = _response_text(response).strip()
+            _store_summary(key, raw_html)
 
         # Normalize HTML into strict sections with IDs so the front-end toggle works reliably
-        def normalize_sections(html: str) -> str:
-            try:
-                from html.parser import HTMLParser
-            except Exception:
-                HTMLParser = None
-
-            # Fast-path: if all three IDs exist, keep as-is
-            if all(x in html for x in ['id="summary"', 'id="recommendations"', 'id="per-airport"']):
-                return html
-
-            # Heuristic wrapper: search for headings and wrap nearby content
-            # Keep it simple to avoid extra deps; operate with string finds.
-            def extract_block(src: str, heading: str, sec_id: str) -> (str, str):
-                idx = src.lower().find(f">{heading.lower()}<")
-                if idx == -1:
-                    # Try with quotes, loose match
-                    idx = src.lower().find(heading.lower())
-                if idx == -1:
-                    return '', src
-                # Backtrack to enclosing heading tag start
-                start_h = src.rfind('<', 0, idx)
-                if start_h == -1:
-                    return '', src
-                # Take from heading start until next heading of same level or end
-                # Simplify: split remainder by next <h1 or <h2 tag
-                rem = src[start_h:]
-                end_pos = len(rem)
-                for tag in ['<h1', '<h2']:
-                    nxt = rem.find(tag, 1)
-                    if nxt != -1:
-                        end_pos = min(end_pos, nxt)
-                block = rem[:end_pos]
-                # Remove block from src
-                new_src = src[:start_h] + rem[end_pos:]
-                # Wrap block
-                wrapped = f'<section id="{sec_id}">{block}</section>'
-                return wrapped, new_src
-
-            src = html
-            out_parts = []
-            # Extract Summary
-            summary_block, src = extract_block(src, 'Summary', 'summary')
-            if summary_block:
-                out_parts.append(summary_block)
-            # Extract Recommendations
-            recs_block, src = extract_block(src, 'Recommendations', 'recommendations')
-            if recs_block:
-                out_parts.append(recs_block)
-            # Whatever remains becomes per-airport
-            remainder = src.strip()
-            if remainder:
-                out_parts.append(f'<section id="per-airport">{remainder}</section>')
-            return '\n'.join(out_parts)
-
         return normalize_sections(raw_html)
     except Exception as e:
         return f"Error generating summary: {str(e)}"
 
+async def summarize_weather_stream(weather_data, pilot_profile, stations):
+    """Yield the briefing HTML as Gemini generates it.
+
+    Sections can only be normalized once the whole response is known, so if the
+    streamed HTML lacks the section IDs a normalized copy is sent last in a
+    <template id="summary-normalized"> for the summary page script to use.
+    """
+    try:
+        dynamic, key = _briefing_request(weather_data, pilot_profile, stations)
+        raw_html = _cached_summary(key)
+        if raw_html is not None:
+            yield normalize_sections(raw_html)
+            return
+
+        parts = []
+        response = await _generate_briefing(dynamic, stream=True)
+        async for chunk in response:
+            text = _response_text(chunk)
+            if text:
+                parts.append(text)
+                yield text
+        raw_html = ''.join(parts).strip()
+        _store_summary(key, raw_html)
+
+        normalized = normalize_sections(raw_html)
+        if normalized != raw_html:
+            yield f'<template id="summary-normalized">{normalized}</template>'
+    except Exception as e:
+        yield f"Error generating summary: {str(e)}"
+
 @app.route('/summarize', methods=['POST'])
-def handle_summarize():
+async def handle_summarize():
     try:
-        data = request.get_json()
+        data = await request.get_json()
         if not data or 'icao_codes' not in data:
             return jsonify({'error': 'Missing icao_codes in request'}), 400
 
@@ -471,27 +770,12 @@ def handle_summarize():
 
         pilot_profile = data.get('pilot_profile', 'general')  # Optional
 
-        # Fetch METAR, TAF, and hazard data
-        metars_text = fetch_metars(codes)
-        tafs_text = fetch_tafs(codes)
-        hazards_text = fetch_sigmet_airmet(hours_before=6)
-        if not metars_text and not tafs_text and not hazards_text:
+        # Fetch METAR, TAF, hazards and airport names, then ask the model for
+        # Summary, Recommendations, and Per-Airport Conditions (HTML snippet)
+        summary_html, stations = await build_briefing(codes, pilot_profile)
+        if summary_html is None:
             return jsonify({'error': 'Failed to fetch METAR/TAF/AIRMET/SIGMET data'}), 502
 
-        combined_text = ''
-        if metars_text:
-            combined_text += 'METARs:\n' + metars_text + '\n\n'
-        if tafs_text:
-            combined_text += 'TAFs:\n' + tafs_text + '\n\n'
-        if hazards_text:
-            combined_text += 'Hazards(if any):\n' + hazards_text + '\n\n'
-
-        # Get airport names for decoding and display inside the model output
-        stations = fetch_station_info(codes)
-
-        # Ask model for Summary, Recommendations, and Per-Airport Conditions (HTML snippet)
-        summary_html = summarize_weather(combined_text.strip(), pilot_profile, stations)
-
         # Final HTML contains only decoded sections (no raw metadata shown)
         final_html = f"""
         <div class=\"weather-brief\">
@@ -500,21 +784,26 @@ def handle_summarize():
         """.strip()
 
         # Keep response key 'summary' for compatibility with the front-end, but it now contains HTML
-        return jsonify({'summary': final_html})
+        return jsonify({'summary': final_html, 'coords': stations})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.post('/api/coords')
-def api_coords():
+async def api_coords():
     try:
-        data = request.get_json() or {}
+        data = (await request.get_json()) or {}
         codes = data.get('icao_codes') or []
         if isinstance(codes, str):
-            codes = [c.strip().upper() for c in codes.split(',') if c.strip()]
-        coords = fetch_station_coords(codes)
+            codes = codes.split(',')
+        codes = normalize_icao_list(" ".join(codes))
+        # A projection of the stations cache warmed by the briefing request; only
+        # stations without coordinates may need the disk/Nominatim fallback
+        coords = station_records(codes, (await fetch_stations_async(codes)) or {})
+        await fill_missing_coords_async(coords)
         return jsonify({"coords": coords})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # Local development only; see the gunicorn command above for production
+    asyncio.run(app.run_task())
\ No newline at end of file
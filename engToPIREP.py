@@ -1,68 +1,212 @@
 import google.generativeai as genai
+import hashlib
 import os
-from datetime import datetime
-
-def convert_english_to_pirep(user_text: str, fields: dict | None = None) -> str:
+import re
+import threading
+from datetime import datetime, timezone
+from cachetools import TTLCache
+
+# Converted PIREPs keyed by a hash of the inputs and the current UTC hour,
+# stored as (pirep_line, time_used) so /TM can be refreshed on a hit.
+PIREP_CACHE = TTLCache(maxsize=1024, ttl=3600)
+_PIREP_CACHE_LOCK = threading.RLock()
+
+# Gemini is configured once per process; the model is created alongside it
+_CONFIGURED = False
+_MODEL = None
+
+def _get_model():
+    """Configure Gemini on first use and return the shared model."""
+    global _CONFIGURED, _MODEL
+    if not _CONFIGURED:
+        api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise RuntimeError("GEMINI_API_KEY (or GOOGLE_API_KEY) is not set.")
+        genai.configure(api_key=api_key)
+        _MODEL = genai.GenerativeModel('gemini-2.5-flash')
+        _CONFIGURED = True
+    return _MODEL
+
+# Module-level setup when the key is already in the environment (e.g. via app.py's load_dotenv)
+if os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY"):
+    _get_model()
+
+# (minute, "HHMMZ") of the last formatted timestamp; swapped as one tuple so threads never see a mix
+_last_hhmmz = (None, None)
+
+def _utc_hhmmz() -> str:
+    """Return the current UTC time as HHMMZ, formatting at most once per minute."""
+    global _last_hhmmz
+    now = datetime.now(timezone.utc)
+    minute = (now.year, now.month, now.day, now.hour, now.minute)
+    last = _last_hhmmz
+    if last[0] != minute:
+        last = _last_hhmmz = (minute, now.strftime("%H%MZ"))
+    return last[1]
+
+# Fixed instructions, output rules and example for the converter; the per-call
+# report text, form fields and time are appended after this.
+PIREP_STATIC_PROMPT = '''
+You are an expert in aviation communications. Translate the provided plain-English pilot report
+into a single-line standardized PIREP string.
+
+You are also given STRUCTURED FIELDS captured from a form. When a field is present there,
+prefer it over any conflicting interpretation from free text. If a field is blank, you may
+infer from the free text. Omit segments that cannot be inferred at all.
+
+Output rules:
+1) Report type: 'UUA' for urgent hazards (severe turbulence/icing, LLWS, volcanic ash, hail, TS), else 'UA'.
+2) Location: /OV [ICAO or relative]. If an airport name is clear, convert to ICAO.
+3) Time: /TM [HHMMZ]. Use the Current UTC time given below unless a precise time is clearly given.
+4) Altitude: /FL [hundreds of feet, 3 digits].
+5) Aircraft: /TP [standard code] if inferable.
+6) Sky cover: /SK [codes+alt] (e.g., BKN080, SCT030, CB) if inferable.
+7) Weather: /WX [codes] (e.g., RA, BR, +SHRA, LTG) if inferable.
+8) Temperature: /TA [C], with M for negative (e.g., M02), if inferable.
+9) Turbulence: /TB [intensity/type] if inferable.
+10) Icing: /IC [intensity/type] if inferable.
+
+Output a SINGLE LINE with only the coded PIREP segments separated by spaces, no extra commentary.
+Example: UUA /OV VIDP /TM 1530Z /FL080 /TP C172 /SK BKN080 /WX BR /TB LGT CHOP /IC NEG
+'''
+
+# Rule-based encoding of form fields, used to skip Gemini when the fields alone
+# give an unambiguous PIREP. Anything not covered here falls back to the model.
+_INTENSITIES = {
+    'trace': 'TRC', 'light': 'LGT', 'lgt': 'LGT', 'moderate': 'MOD', 'mod': 'MOD',
+    'severe': 'SEV', 'sev': 'SEV', 'extreme': 'EXTRM',
+}
+_TB_INTENSITIES = frozenset({'LGT', 'MOD', 'SEV', 'EXTRM'})
+_CHOP_INTENSITIES = frozenset({'LGT', 'MOD'})
+_IC_INTENSITIES = frozenset({'TRC', 'LGT', 'MOD', 'SEV'})
+# Hazard word -> (segment, suffix, intensities valid for that hazard)
+_HAZARDS = {
+    'turbulence': ('TB', '', _TB_INTENSITIES), 'turb': ('TB', '', _TB_INTENSITIES),
+    'chop': ('TB', ' CHOP', _CHOP_INTENSITIES),
+    'icing': ('IC', '', _IC_INTENSITIES), 'ice': ('IC', '', _IC_INTENSITIES),
+}
+# (intensity, segment) pairs that make the report urgent (UUA)
+_URGENT = frozenset({('SEV', 'TB'), ('EXTRM', 'TB'), ('SEV', 'IC')})
+_ICAO_RE = re.compile(r"[A-Z]{4}")
+_AIRCRAFT_RE = re.compile(r"[A-Z][A-Z0-9]{1,3}")
+_ALTITUDE_RE = re.compile(r"(FL)?\s*(\d{1,3}(?:,\d{3})+|\d+)\s*(?:FT|FEET)?")
+
+def encode_pirep_from_fields(fields: dict, current_time: str) -> str | None:
     """
-    Convert a free-text pilot report into a single-line standardized PIREP string using Gemini.
+    Build a PIREP line from structured form fields without calling Gemini.
 
-    Requires GEMINI_API_KEY (or GOOGLE_API_KEY) in environment.
+    Returns None when the fields are missing or ambiguous (e.g. a relative
+    location, an aircraft name rather than a type code, a bare altitude under
+    1000, or a problem type other than turbulence/chop/icing with an intensity
+    valid for it), so the caller can fall back to the model.
+    """
+    location = (fields.get('location') or '').strip().upper()
+    altitude = (fields.get('altitude') or '').strip().upper()
+    aircraft_model = (fields.get('aircraft_model') or '').strip().upper()
+    problem_type = (fields.get('problem_type') or '').strip().lower()
+    if not location or not altitude or not _ICAO_RE.fullmatch(location):
+        return None
+    if aircraft_model and not _AIRCRAFT_RE.fullmatch(aircraft_model):
+        return None
+
+    m = _ALTITUDE_RE.fullmatch(altitude)
+    if not m:
+        return None
+    value = int(m.group(2).replace(',', ''))
+    if m.group(1):
+        flight_level = value
+    elif value >= 1000:
+        flight_level = value // 100
+    else:
+        # A bare value under 1000 could be feet or hundreds of feet
+        return None
+    if not 0 <= flight_level <= 999:
+        return None
+
+    hazards = {}
+    for part in re.split(r"\s*(?:,|;|\band\b|\bwith\b)\s*", problem_type):
+        if not part:
+            continue
+        words = part.split()
+        if len(words) != 2 or words[0] not in _INTENSITIES or words[1] not in _HAZARDS:
+            return None
+        segment, suffix, allowed = _HAZARDS[words[1]]
+        intensity = _INTENSITIES[words[0]]
+        if intensity not in allowed or segment in hazards:
+            return None
+        hazards[segment] = (intensity, suffix)
+    if problem_type and not hazards:
+        # Only separators ("and", ","): don't drop the reported problem silently
+        return None
+
+    urgent = any((intensity, segment) in _URGENT for segment, (intensity, _) in hazards.items())
+    segments = ["UUA" if urgent else "UA", f"/OV {location}", f"/TM {current_time}", f"/FL{flight_level:03d}"]
+    if aircraft_model:
+        segments.append(f"/TP {aircraft_model}")
+    for segment in ('TB', 'IC'):
+        if segment in hazards:
+            intensity, suffix = hazards[segment]
+            segments.append(f"/{segment} {intensity}{suffix}")
+    return " ".join(segments)
+
+def convert_english_to_pirep(user_text: str, fields: dict | None = None, *, allow_fast_path: bool = True) -> str:
     """
-    api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        raise RuntimeError("GEMINI_API_KEY (or GOOGLE_API_KEY) is not set.")
+    Convert a free-text pilot report into a single-line standardized PIREP string using Gemini.
 
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-2.5-flash')
+    When ``fields`` alone determine the PIREP (see encode_pirep_from_fields) and
+    ``allow_fast_path`` is set, the line is built locally without a model call;
+    pass ``allow_fast_path=False`` when ``user_text`` carries details the fields lack.
 
-    current_time = datetime.utcnow().strftime("%H%MZ")
+    Requires GEMINI_API_KEY (or GOOGLE_API_KEY) in environment for the Gemini path.
+    """
+    current_time = _utc_hhmmz()
 
     # Prepare a structured-fields snippet to bias/assist the model.
     fields = fields or {}
+    if allow_fast_path and fields:
+        line = encode_pirep_from_fields(fields, current_time)
+        if line:
+            return line
+
+    model = _get_model()
+
     problem_type = (fields.get('problem_type') or '').strip()
     location = (fields.get('location') or '').strip()
     aircraft_model = (fields.get('aircraft_model') or '').strip()
     altitude = (fields.get('altitude') or '').strip()
 
-    prompt = f'''
-    You are an expert in aviation communications. Translate the provided plain-English pilot report
-    into a single-line standardized PIREP string.
-
-    You are also given STRUCTURED FIELDS captured from a form. When a field is present there,
-    prefer it over any conflicting interpretation from free text. If a field is blank, you may
-    infer from the free text. Omit segments that cannot be inferred at all.
-
-    Provided Text:
-    """
-    {user_text}
-    """
-
-    Structured Fields (prefer these when present):
-      - Problem Type: {problem_type}
-      - Location (ICAO or relative): {location}
-      - Aircraft Model: {aircraft_model}
-      - Altitude: {altitude}
-
-    Current UTC time: {current_time}
-
-    Output rules:
-    1) Report type: 'UUA' for urgent hazards (severe turbulence/icing, LLWS, volcanic ash, hail, TS), else 'UA'.
-    2) Location: /OV [ICAO or relative]. If an airport name is clear, convert to ICAO.
-    3) Time: /TM [HHMMZ]. Use {current_time} unless a precise time is clearly given.
-    4) Altitude: /FL [hundreds of feet, 3 digits].
-    5) Aircraft: /TP [standard code] if inferable.
-    6) Sky cover: /SK [codes+alt] (e.g., BKN080, SCT030, CB) if inferable.
-    7) Weather: /WX [codes] (e.g., RA, BR, +SHRA, LTG) if inferable.
-    8) Temperature: /TA [C], with M for negative (e.g., M02), if inferable.
-    9) Turbulence: /TB [intensity/type] if inferable.
-    10) Icing: /IC [intensity/type] if inferable.
-
-    Output a SINGLE LINE with only the coded PIREP segments separated by spaces, no extra commentary.
-    Example: UUA /OV VIDP /TM {current_time} /FL080 /TP C172 /SK BKN080 /WX BR /TB LGT CHOP /IC NEG
-    '''
-
-    response = model.generate_content(prompt)
-    return (response.text or "").strip()
+    # Only the tail of the prompt varies per call; the fixed rules stay a cacheable prefix.
+    dynamic = f'''
+Provided Text:
+"""
+{user_text}
+"""
+
+Structured Fields (prefer these when present):
+  - Problem Type: {problem_type}
+  - Location (ICAO or relative): {location}
+  - Aircraft Model: {aircraft_model}
+  - Altitude: {altitude}
+
+Current UTC time: {current_time}
+'''
+
+    key = hashlib.sha256("\x1f".join([
+        current_time[:2], user_text, problem_type, location, aircraft_model, altitude,
+    ]).encode()).hexdigest()
+    with _PIREP_CACHE_LOCK:
+        hit = PIREP_CACHE.get(key)
+    if hit is not None:
+        line, time_used = hit
+        # Keep /TM current when the cached line used the then-current time
+        return line.replace(f"/TM {time_used}", f"/TM {current_time}")
+
+    response = model.generate_content([PIREP_STATIC_PROMPT, dynamic])
+    line = (response.text or "").strip()
+    if line:
+        with _PIREP_CACHE_LOCK:
+            PIREP_CACHE[key] = (line, current_time)
+    return line
 
 def main():
     """